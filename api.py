@@ -0,0 +1,108 @@
+import json
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+class Response:
+    __slots__ = ("status", "kind", "data", "text", "headers")
+
+    def __init__(self, status, kind, data, text, headers):
+        self.status = status
+        self.kind = kind
+        self.data = data
+        self.text = text
+        self.headers = headers
+
+    @property
+    def ok(self):
+        return self.kind == "ok"
+
+    def get(self, key, default=None):
+        if isinstance(self.data, dict):
+            return self.data.get(key, default)
+        return default
+
+
+def classify(res):
+    status = res.status_code
+    ctype = res.headers.get("content-type", "").split(";")[0].strip().lower()
+    text = res.text
+    if status == 429:
+        return Response(status, "rate_limited", None, text, res.headers)
+    if ctype == "text/html":
+        return Response(status, "html", None, text, res.headers)
+    if not res.content:
+        kind = "server_error" if status >= 500 else "ok"
+        return Response(status, kind, None, text, res.headers)
+    try:
+        data = loads(res.content)
+    except ValueError:
+        kind = "server_error" if status >= 500 else "invalid"
+        return Response(status, kind, None, text, res.headers)
+    if status >= 500:
+        return Response(status, "server_error", data, text, res.headers)
+    if isinstance(data, dict) and data.get("detail") == "Rate limit exceeded.":
+        return Response(status, "rate_limited", data, text, res.headers)
+    return Response(status, "ok", data, text, res.headers)
+
+
+def as_dict(data):
+    return data if isinstance(data, dict) else {}
+
+
+class Streak:
+    __slots__ = ("streak",)
+
+    def __init__(self, data):
+        self.streak = as_dict(data).get("streak")
+
+
+class User:
+    __slots__ = ("id", "rating")
+
+    def __init__(self, data):
+        data = as_dict(data)
+        self.id = data.get("id")
+        self.rating = data.get("rating")
+
+
+class Task:
+    __slots__ = ("id", "title", "is_completed", "detail")
+
+    def __init__(self, data):
+        data = as_dict(data)
+        self.id = data.get("id")
+        self.title = data.get("title")
+        self.is_completed = data.get("is_completed")
+        self.detail = data.get("detail")
+
+    @classmethod
+    def parse_list(cls, data):
+        if not isinstance(data, list):
+            return []
+        return [cls(i) for i in data]
+
+
+class GameCooldown:
+    __slots__ = ("blocked_until",)
+
+    def __init__(self, data):
+        detail = as_dict(data).get("detail")
+        self.blocked_until = None
+        if isinstance(detail, dict) and detail.get("blocked_until") is not None:
+            self.blocked_until = int(detail.get("blocked_until"))
+
+
+class Reward:
+    __slots__ = ("success", "rating_award", "correct")
+
+    def __init__(self, data):
+        data = as_dict(data)
+        self.success = data.get("success")
+        self.rating_award = data.get("rating_award")
+        self.correct = data.get("correct") or ""
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import httpx
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+from urllib.parse import quote
+import bot
+import models
+from console import console
+from metrics import metrics
+
+games = {
+    "/api/durov/": 24 * 3600,
+    "/api/roulette/": 8 * 3600,
+    "/api/bonuses/coins/": 8 * 3600,
+    "/api/swipe_coin/": 8 * 3600,
+}
+
+
+def b64(data):
+    return urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+class MockMajor:
+    def __init__(self, latency=0.05, jitter=0.5, html_rate=0.0, rate=0, burst=50):
+        self.latency = latency
+        self.jitter = jitter
+        self.html_rate = html_rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.cooldowns = {}
+        self.completed = set()
+        self.requests = 0
+        self.rate_limited = 0
+        self.html = 0
+
+    def token(self, uid):
+        exp = int(datetime.now().timestamp()) + 24 * 3600
+        return f"{b64({'alg': 'none'})}.{b64({'sub': uid, 'exp': exp})}.mock"
+
+    def account(self, request):
+        auth = request.headers.get("authorization", "")
+        try:
+            payload = auth.split(" ")[1].split(".")[1]
+            return json.loads(urlsafe_b64decode(payload + "==")).get("sub")
+        except (IndexError, ValueError):
+            return None
+
+    def limited(self):
+        if not self.rate:
+            return False
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return True
+        self.tokens -= 1
+        return False
+
+    async def __call__(self, request):
+        self.requests += 1
+        delay = self.latency * random.uniform(1 - self.jitter, 1 + self.jitter)
+        await asyncio.sleep(max(0, delay))
+        if self.limited():
+            self.rate_limited += 1
+            return httpx.Response(
+                429,
+                json={"detail": "Rate limit exceeded."},
+                headers={"retry-after": "1"},
+            )
+        if random.random() < self.html_rate:
+            self.html += 1
+            return httpx.Response(
+                502,
+                text="<html><head><title>502 Bad Gateway</title></head></html>",
+                headers={"content-type": "text/html"},
+            )
+        return self.route(request)
+
+    def route(self, request):
+        path = request.url.path
+        method = request.method
+        if path == "/major/durov.json":
+            tday = datetime.now(tz=timezone.utc).isoformat().split("T")[0]
+            answer = {"choice_1": 1, "choice_2": 2, "choice_3": 3, "choice_4": 4}
+            return httpx.Response(200, json={tday: answer})
+        if path == "/api/auth/tg/":
+            query = json.loads(request.content).get("init_data", "")
+            user = bot.parse_user(query)
+            if user is None:
+                return httpx.Response(400, json={"detail": "Invalid init data"})
+            return httpx.Response(200, json={"access_token": self.token(user["id"])})
+        uid = self.account(request)
+        if uid is None:
+            return httpx.Response(401, json={"detail": "Unauthorized"})
+        if path == "/api/user-visits/streak/":
+            return httpx.Response(200, json={"streak": 1})
+        if path == "/api/user-visits/visit/":
+            return httpx.Response(200, json={"is_increased": True})
+        if path.startswith("/api/users/"):
+            return httpx.Response(200, json={"id": uid, "rating": 1000 + uid % 100})
+        if path == "/api/tasks/":
+            if method == "GET":
+                base = 100 if request.url.params.get("is_daily") == "true" else 200
+                tasks = [{"id": base + i, "title": f"task {base + i}"} for i in range(5)]
+                return httpx.Response(200, json=tasks)
+            task_id = json.loads(request.content).get("task_id")
+            if (uid, task_id) in self.completed:
+                return httpx.Response(
+                    400, json={"detail": "Task is already completed"}
+                )
+            self.completed.add((uid, task_id))
+            return httpx.Response(201, json={"is_completed": True})
+        if path in games:
+            key = (uid, path)
+            now = int(datetime.now().timestamp())
+            blocked_until = self.cooldowns.get(key, 0)
+            if blocked_until > now:
+                detail = {"blocked_until": blocked_until}
+                return httpx.Response(400, json={"detail": detail})
+            if method == "GET":
+                return httpx.Response(200, json={"success": True})
+            self.cooldowns[key] = now + games[path]
+            return httpx.Response(
+                201,
+                json={
+                    "success": True,
+                    "rating_award": 1000,
+                    "correct": ["1", "2", "3", "4"],
+                },
+            )
+        return httpx.Response(404, json={"detail": "Not found."})
+
+
+class Timed(httpx.AsyncBaseTransport):
+    def __init__(self, transport):
+        self.transport = transport
+        self.latencies = []
+
+    async def handle_async_request(self, request):
+        started = time.monotonic()
+        try:
+            return await self.transport.handle_async_request(request)
+        finally:
+            self.latencies.append(time.monotonic() - started)
+
+
+def query(uid):
+    user = {
+        "id": uid,
+        "first_name": f"bench {uid}",
+        "last_name": "",
+        "language_code": "en",
+        "allows_write_to_pm": True,
+    }
+    user = quote(json.dumps(user, separators=(",", ":")))
+    return f"query_id=AAH{uid}&user={user}&auth_date=1700000000&hash={uid:064x}"
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run_start(args, cfg):
+    sem = asyncio.Semaphore(args.worker)
+    datas, proxies = await bot.get_data()
+
+    async def bound(no, query, user):
+        async with sem:
+            return await bot.MajTod(no, query, proxies, cfg, user=user).start()
+
+    await asyncio.gather(
+        *[bound(no, query, user) for no, (query, user) in enumerate(datas)]
+    )
+
+
+async def run_scheduler(args, cfg):
+    bot.controller.resize(args.worker, maximum=args.worker)
+    scheduler = bot.Scheduler(bot.controller, cfg)
+    task = asyncio.create_task(scheduler.run())
+    while scheduler.runs < args.accounts and not task.done():
+        await asyncio.sleep(0.1)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def bench(args):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="major-bench-") as workdir:
+        os.chdir(workdir)
+        try:
+            return await run_bench(args, workdir)
+        finally:
+            os.chdir(cwd)
+
+
+async def run_bench(args, workdir):
+    models.database = os.path.join(workdir, "database.sqlite3")
+    bot.data_file = os.path.join(workdir, "data.txt")
+    bot.proxy_file = os.path.join(workdir, "proxies.txt")
+    bot.task_delay = args.task_delay
+    bot.rate_limit = args.rate
+    bot.burst_limit = max(1, args.burst)
+    console.mode = "quiet"
+    with open(bot.data_file, "w") as w:
+        w.write("\n".join(query(100000 + i) for i in range(args.accounts)))
+    with open(bot.proxy_file, "w") as w:
+        w.write("")
+    mock = MockMajor(
+        latency=args.latency / 1000,
+        html_rate=args.html_rate,
+        rate=args.server_rate,
+        burst=args.server_burst,
+    )
+    transport = Timed(httpx.MockTransport(mock))
+    bot.clients[None] = httpx.AsyncClient(transport=transport, timeout=60)
+    cfg = models.Config(auto_task=not args.no_task)
+    await models.init()
+    await bot.http_log.start()
+    await console.start()
+    results = []
+    try:
+        for cycle in range(args.repeat):
+            requests = mock.requests
+            retries = sum(metrics.retries.values())
+            rate_limited = mock.rate_limited
+            html = mock.html
+            transport.latencies = []
+            started = time.monotonic()
+            if args.mode == "start":
+                await run_start(args, cfg)
+            else:
+                await run_scheduler(args, cfg)
+            await models.flush()
+            elapsed = time.monotonic() - started
+            results.append(
+                {
+                    "cycle": cycle + 1,
+                    "mode": args.mode,
+                    "accounts": args.accounts,
+                    "elapsed": round(elapsed, 3),
+                    "accounts_per_second": round(args.accounts / elapsed, 2),
+                    "requests": mock.requests - requests,
+                    "requests_per_account": round(
+                        (mock.requests - requests) / args.accounts, 2
+                    ),
+                    "p50_ms": round(percentile(transport.latencies, 50) * 1000, 2),
+                    "p99_ms": round(percentile(transport.latencies, 99) * 1000, 2),
+                    "retries": sum(metrics.retries.values()) - retries,
+                    "rate_limited": mock.rate_limited - rate_limited,
+                    "html_errors": mock.html - html,
+                    "peak_rss_mb": round(
+                        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+                    ),
+                }
+            )
+    finally:
+        await bot.close_clients()
+        await bot.http_log.close()
+        await models.close()
+        await console.close()
+    return results
+
+
+def main():
+    arg = argparse.ArgumentParser(description="Benchmark MajTod against a local mock api")
+    arg.add_argument("--accounts", "-N", type=int, default=100)
+    arg.add_argument("--worker", "-W", type=int, default=50)
+    arg.add_argument("--mode", choices=("scheduler", "start"), default="scheduler")
+    arg.add_argument("--repeat", type=int, default=2, help="Cycles to run")
+    arg.add_argument("--latency", type=float, default=50, help="Mock latency in ms")
+    arg.add_argument("--html-rate", type=float, default=0.0)
+    arg.add_argument("--server-rate", type=float, default=0, help="Mock rate limit")
+    arg.add_argument("--server-burst", type=int, default=50)
+    arg.add_argument("--rate", type=float, default=0, help="Client rate limit")
+    arg.add_argument("--burst", type=int, default=20)
+    arg.add_argument("--no-task", action="store_true")
+    arg.add_argument(
+        "--task-delay", type=int, default=0, help="Seconds to wait after each task"
+    )
+    arg.add_argument("--json", action="store_true")
+    args = arg.parse_args()
+    results = asyncio.run(bench(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print(" ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
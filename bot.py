@@ -1,38 +1,71 @@
+import time
+
+boot = time.perf_counter()
+
 import os
-import re
+import sys
 import json
 import httpx
 import anyio
 import random
 import asyncio
+import gzip
+import heapq
+import sqlite3
+import shutil
 import argparse
+import multiprocessing
 import aiofiles
 import aiofiles.os
-import python_socks
 from glob import glob
+from collections import deque
+from queue import Empty
 import aiofiles.ospath
 from pathlib import Path
+from http.cookiejar import CookieJar, DefaultCookiePolicy
 from urllib.parse import parse_qs
+from email.utils import parsedate_to_datetime
 from base64 import urlsafe_b64decode
 from datetime import datetime, timezone
 from colorama import init as inits, Fore, Style
+from api import classify, loads, Streak, User, Task, GameCooldown, Reward
+from console import console
+from metrics import metrics
 from models import (
     insert,
     get_by_id,
     Config,
     init,
+    close,
+    flush,
     update_balance,
     update_token,
     update_useragent,
+    get_cooldowns,
+    update_cooldown,
+    get_completed_tasks,
+    complete_task,
+    get_expiring,
+    get_summary,
 )
-from httpx_socks import AsyncProxyTransport
-from fake_useragent import UserAgent
+
+import_time = time.perf_counter() - boot
 
 log_file = "http.log"
 proxy_file = "proxies.txt"
 data_file = "data.txt"
 token_file = "tokens.json"
 config_file = "config.json"
+client_timeout = 1000
+game_worker = 2
+task_delay = 3
+max_worker = 50
+clients = {}
+useragents = None
+breakers = {}
+limiters = {}
+rate_limit = 10
+burst_limit = 20
 inits(autoreset=True)
 red = Fore.LIGHTRED_EX
 blue = Fore.LIGHTBLUE_EX
@@ -44,29 +77,32 @@ reset = Style.RESET_ALL
 line = white + "~" * 50
 
 
+def parse_user(query):
+    marin = lambda data: {key: value[0] for key, value in parse_qs(data).items()}
+    user = marin(query).get("user")
+    if user is None:
+        return None
+    try:
+        user = json.loads(user)
+    except ValueError:
+        return None
+    if not isinstance(user, dict) or not isinstance(user.get("id"), int):
+        return None
+    return {"id": user.get("id"), "first_name": user.get("first_name")}
+
+
 class MajTod:
-    def __init__(self, id: int, query: str, proxies: list, cfg=Config):
-        marin = lambda data: {key: value[0] for key, value in parse_qs(data).items()}
-        parser = marin(query)
-        user = parser.get("user")
+    def __init__(self, id: int, query: str, proxies: list, cfg=Config, user=None):
         self.p = id
         self.cfg = cfg
         self.valid = True
+        if user is None:
+            user = parse_user(query)
         if user is None:
             self.valid = False
-            self.log(f"{red}The data entered has wrong format !")
-            return None
-        self.user = {}
-        uid = re.search(r"\"id\"\:(.*?)\,", user)
-        first_name = re.search(r"\"first_name\"\:\"(.*?)\"\,", user)
-        if uid:
-            self.user["id"] = uid.group(1)
-            if first_name:
-                self.user["first_name"] = first_name.group(1)
-        else:
-            self.valid = False
-            self.log(f"{red}The data entered has wrong format !")
+            self.log(f"{red}The data entered has wrong format !", "error", "data")
             return None
+        self.user = user
         self.headers = {
             "accept": "application/json, text/plain, */*",
             "user-agent": "Mozilla/5.0 (Linux; Android 11; K) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/106.0.5249.79 Mobile Safari/537.36",
@@ -79,109 +115,142 @@ class MajTod:
         }
         self.query = query
         self.proxies = proxies
+        self.proxy = None
         if len(self.proxies) > 0:
-            proxy = self.get_random_proxy(id, False)
-            transport = AsyncProxyTransport.from_url(proxy)
-            self.ses = httpx.AsyncClient(transport=transport, timeout=1000)
-        else:
-            self.ses = httpx.AsyncClient(timeout=1000)
+            self.proxy = proxy_pool.assign(user["id"])
 
-    def log(self, msg):
-        now = datetime.now().isoformat().split("T")[1].split(".")[0]
-        print(
-            f"{black}[{now}]{white}-{blue}[{white}acc {self.p + 1}{blue}]{white} {msg}{reset}"
-        )
+    @property
+    def ses(self):
+        return get_client(self.proxy)
+
+    def log(self, msg, level="info", event="log", **fields):
+        console.emit(level, event, msg, account=self.p + 1, **fields)
 
     async def ipinfo(self):
-        ipinfo1_url = "https://ipapi.co/json/"
-        ipinfo2_url = "https://ipwho.is/"
-        ipinfo3_url = "https://freeipapi.com/api/json"
-        try:
-            res = await self.ses.get(ipinfo1_url)
-            ip = res.json().get("ip")
-            country = res.json().get("country")
-            if not ip:
-                res = await self.ses.get(ipinfo2_url)
-                ip = res.json().get("ip")
-                country = res.json().get("country_code")
-                if not ip:
-                    res = await self.ses.get(ipinfo3_url)
-                    ip = res.json().get("ipAddress")
-                    country = res.json().get("countryCode")
-            self.log(f"{green}ip : {white}{ip} {green}country : {white}{country}")
-        except json.decoder.JSONDecodeError:
-            self.log(f"{green}ip : {white}None {green}country : {white}None")
-
-    def get_random_proxy(self, isself, israndom=False):
-        if israndom:
-            return random.choice(self.proxies)
-        return self.proxies[isself % len(self.proxies)]
+        ip, country = await ip_info.get(self.proxy)
+        self.log(
+            f"{green}ip : {white}{ip} {green}country : {white}{country}",
+            event="ipinfo",
+            ip=ip,
+            country=country,
+        )
+
+    def proxy_failure(self, switch=False):
+        if self.proxy is None:
+            return
+        proxy_pool.failure(self.proxy)
+        if switch or not proxy_pool.healthy(self.proxy):
+            self.proxy = proxy_pool.best(exclude=self.proxy) or self.proxy
 
     async def http(self, url, headers, data=None):
+        breaker = get_breaker(url)
+        limiter = get_limiter(url)
+        attempt = 0
         while True:
+            await limiter.acquire()
+            probe = await breaker.wait()
+            wait = None
             try:
-                await asyncio.sleep(0.5)
-                if not await aiofiles.ospath.exists(log_file):
-                    async with aiofiles.open(log_file, "w") as w:
-                        await w.write("")
-                logsize = await aiofiles.ospath.getsize(log_file)
-                if logsize / 1024 / 1024 > 1:
-                    async with aiofiles.open(log_file, "w") as w:
-                        await w.write("")
+                started = time.monotonic()
                 if data is None:
                     res = await self.ses.get(url, headers=headers)
                 elif data == "":
                     res = await self.ses.post(url, headers=headers)
                 else:
                     res = await self.ses.post(url, headers=headers, data=data)
-                async with aiofiles.open(log_file, "a", encoding="utf-8") as hw:
-                    await hw.write(f"{res.text}\n")
-                if "<title>" in res.text:
-                    self.log(f"{yellow}failed get json response !")
-                    await countdown(3)
-                    continue
-                if (
-                    "Rate limit exceeded." in res.text
-                    or "Internal Server Error" in res.text
-                ):
-                    self.log(f"{yellow}failed get json response !")
-                    await countdown(3)
-                    continue
-
-                return res
-            except (
-                httpx.ProxyError,
-                python_socks._errors.ProxyTimeoutError,
-                python_socks._errors.ProxyError,
-                python_socks._errors.ProxyConnectionError,
-            ):
-                proxy = self.get_random_proxy(0, israndom=True)
-                transport = AsyncProxyTransport.from_url(proxy)
-                self.ses = httpx.AsyncClient(transport=transport)
-                self.log(f"{yellow}proxy error,selecting random proxy !")
-                await asyncio.sleep(3)
-                continue
-            except httpx.NetworkError:
-                self.log(f"{yellow}network error !")
-                await asyncio.sleep(3)
-                continue
-            except httpx.TimeoutException:
-                self.log(f"{yellow}connection timeout !")
-                await asyncio.sleep(3)
-                continue
-            except (httpx.RemoteProtocolError, anyio.EndOfStream):
-                self.log(f"{yellow}connection close without response !")
-                await asyncio.sleep(3)
-                continue
+                latency = time.monotonic() - started
+                res = classify(res)
+                metrics.request(url, latency, res.kind)
+                http_log.write(res.text)
+                if res.kind == "html":
+                    self.log(
+                        f"{yellow}failed get json response !",
+                        "warning",
+                        "retry",
+                        url=url,
+                        reason=res.kind,
+                    )
+                    breaker.failure(probe)
+                    controller.record(latency, error=True)
+                elif not res.ok:
+                    self.log(
+                        f"{yellow}failed get json response !",
+                        "warning",
+                        "retry",
+                        url=url,
+                        reason=res.kind,
+                    )
+                    if res.kind != "rate_limited":
+                        breaker.failure(probe)
+                    controller.record(
+                        latency,
+                        error=True,
+                        limited=res.kind == "rate_limited",
+                    )
+                    wait = retry_after(res)
+                else:
+                    breaker.success()
+                    controller.record(latency)
+                    if self.proxy is not None:
+                        proxy_pool.success(self.proxy, latency)
+                    return res
+            except proxy_errors() as e:
+                metrics.error(url, type(e).__name__)
+                self.proxy_failure(switch=True)
+                self.log(
+                    f"{yellow}proxy error,selecting best healthy proxy !",
+                    "warning",
+                    "retry",
+                    url=url,
+                    reason="proxy",
+                )
+            except httpx.NetworkError as e:
+                metrics.error(url, type(e).__name__)
+                self.log(
+                    f"{yellow}network error !", "warning", "retry", url=url, reason="network"
+                )
+                breaker.failure(probe)
+                controller.record(error=True)
+                self.proxy_failure()
+            except httpx.TimeoutException as e:
+                metrics.error(url, type(e).__name__)
+                self.log(
+                    f"{yellow}connection timeout !",
+                    "warning",
+                    "retry",
+                    url=url,
+                    reason="timeout",
+                )
+                breaker.failure(probe)
+                controller.record(error=True)
+                self.proxy_failure()
+            except (httpx.RemoteProtocolError, anyio.EndOfStream) as e:
+                metrics.error(url, type(e).__name__)
+                self.log(
+                    f"{yellow}connection close without response !",
+                    "warning",
+                    "retry",
+                    url=url,
+                    reason="closed",
+                )
+                breaker.failure(probe)
+                controller.record(error=True)
+                self.proxy_failure()
+            finally:
+                if probe:
+                    breaker.release()
+            if attempt >= retry_policy.budget:
+                metrics.error(url, RetryError.__name__)
+                raise RetryError(f"giving up on {url} after {attempt + 1} attempts")
+            metrics.retry(url)
+            await asyncio.sleep(retry_policy.delay(attempt, wait))
+            attempt += 1
 
-    def is_expired(self, token):
-        if token is None or isinstance(token, bool):
+    def is_expired(self, exp, margin=60):
+        if exp is None:
             return True
-        header, payload, sign = token.split(".")
-        deload = urlsafe_b64decode(payload + "==")
-        jeload = json.loads(deload)
-        now = (datetime.now().timestamp()) + 300
-        if now > jeload.get("exp"):
+        now = datetime.now().timestamp() + margin
+        if now > exp:
             return True
         return False
 
@@ -191,14 +260,21 @@ class MajTod:
         }
         auth_url = "https://major.glados.app/api/auth/tg/"
         res = await self.http(auth_url, self.headers, json.dumps(data))
-        token = res.json().get("access_token")
+        token = res.get("access_token")
         if token is None:
             return False
-        # return token
         self.headers["authorization"] = f"Bearer {token}"
-        await update_token(id=self.user.get("id"), token=token)
+        await update_token(id=self.user.get("id"), token=token, exp=token_exp(token))
+        return token
 
     async def start(self):
+        started = time.monotonic()
+        try:
+            return await self.cycle()
+        finally:
+            metrics.cycle(self.p + 1, time.monotonic() - started)
+
+    async def cycle(self):
         if not self.valid:
             return int(datetime.now().timestamp()) + 8 * 3600
         if len(self.proxies) > 0:
@@ -211,25 +287,28 @@ class MajTod:
         first_name = self.user.get("first_name")
         res = await get_by_id(uid)
         if res is None:
-            await insert(uid, first_name)
-            res = await get_by_id(uid)
-        self.log(f"{green}login as {white}{first_name}")
+            res = await insert(uid, first_name)
+        self.log(f"{green}login as {white}{first_name}", event="login", uid=uid)
         token = res.get("token")
         useragent = res.get("useragent")
         if not useragent:
-            useragent = UserAgent().random
+            useragent = random_useragent()
             await update_useragent(uid, useragent)
         self.headers["user-agent"] = useragent
         self.headers["authorization"] = f"Bearer {token}"
-        if self.is_expired(token):
+        exp = res.get("token_exp")
+        if token and exp is None:
+            exp = token_exp(token)
+            await update_token(uid, token, exp)
+        if self.is_expired(exp):
             token = await self.login()
             if token is False:
                 return int(datetime.now().timestamp()) + 8 * 3600
         streak_url = "https://major.bot/api/user-visits/streak/"
         visit_url = "https://major.bot/api/user-visits/visit/"
         res = await self.http(streak_url, self.headers)
-        streak = res.json().get("streak")
-        self.log(f"{green}streak : {white}{streak}")
+        streak = Streak(res.data).streak
+        self.log(f"{green}streak : {white}{streak}", event="streak", streak=streak)
         await self.http(visit_url, self.headers, "")
         await self.getme()
         if self.cfg.auto_task:
@@ -239,138 +318,784 @@ class MajTod:
         return min_countdown
 
     async def solve_task(self):
+        uid = self.user.get("id")
         urls = [
-            "https://major.bot/api/tasks/?is_daily=true",
-            "https://major.bot/api/tasks/?is_daily=false",
+            ("https://major.bot/api/tasks/?is_daily=true", True),
+            ("https://major.bot/api/tasks/?is_daily=false", False),
         ]
-        for url in urls:
+        for url, is_daily in urls:
             solve_url = "https://major.bot/api/tasks/"
             res = await self.http(url, self.headers)
-            for i in res.json():
-                id = i.get("id")
-                title = i.get("title")
+            completed = await get_completed_tasks(uid, is_daily)
+            for task in Task.parse_list(res.data):
+                id = task.id
+                title = task.title
+                if id in completed:
+                    continue
                 solve_data = {"task_id": id}
                 res = await self.http(solve_url, self.headers, json.dumps(solve_data))
-                detail = res.json().get("detail")
-                is_complete = res.json().get("is_completed")
+                result = Task(res.data)
+                detail = result.detail
+                is_complete = result.is_completed
                 if detail is not None:
                     if detail == "Task is already completed":
-                        self.log(f"{yellow}already completed task {white}{title}")
+                        self.log(
+                            f"{yellow}already completed task {white}{title}",
+                            event="task",
+                            task=id,
+                            status="already",
+                        )
+                        await complete_task(uid, id, is_daily)
                         continue
                 if is_complete:
-                    self.log(f"{green}successfully completed task {white}{title}")
-                    await countdown(3)
+                    self.log(
+                        f"{green}successfully completed task {white}{title}",
+                        event="task",
+                        task=id,
+                        status="completed",
+                    )
+                    await complete_task(uid, id, is_daily)
+                    await countdown(task_delay)
                     continue
-                self.log(f"{red}failed to complete task {white}{title}")
+                self.log(
+                    f"{red}failed to complete task {white}{title}",
+                    "error",
+                    "task",
+                    task=id,
+                    status="failed",
+                )
 
     async def getme(self):
         uid = self.user.get("id")
         first_name = self.user.get("first_name")
         url = "https://major.bot/api/users/" + str(uid) + "/"
         res = await self.http(url, self.headers)
-        balance = res.json().get("rating")
+        balance = User(res.data).rating
         await update_balance(uid, balance)
-        self.log(f"{green}balance : {white}{balance}")
+        self.log(f"{green}balance : {white}{balance}", event="balance", balance=balance)
 
-    async def playgame(self):
-        roulette_url = "https://major.glados.app/api/roulette/"
-        bonus_url = "https://major.glados.app/api/bonuses/coins/"
-        swipe_coin_url = "https://major.glados.app/api/swipe_coin/"
+    async def blocked(self, url, game, name, cooldowns):
+        now = int(datetime.now().timestamp())
+        next_timestamp = cooldowns.get(game, 0)
+        if next_timestamp <= now:
+            res = await self.http(url, self.headers)
+            next_timestamp = GameCooldown(res.data).blocked_until
+            if next_timestamp is None:
+                return None
+            cooldowns[game] = next_timestamp
+            await update_cooldown(self.user.get("id"), game, next_timestamp)
+        next_isoformat = (
+            datetime.fromtimestamp(next_timestamp).isoformat(" ").split(".")[0]
+        )
+        self.log(
+            f"{yellow}next time to play {name} : {white}{next_isoformat}",
+            event="cooldown",
+            game=game,
+            blocked_until=next_timestamp,
+        )
+        return next_timestamp
+
+    async def puzzle(self, cooldowns, sem):
         puzzle_url = "https://major.bot/api/durov/"
-        puzzle_answer_url = "https://akasakaid.github.io/major/durov.json"
-        timestamps = []
         for i in range(2):
-            res = await self.http(puzzle_url, self.headers)
-            detail = res.json().get("detail")
-            if detail is not None:
-                next_timestamp = int(detail.get("blocked_until"))
-                timestamps.append(next_timestamp)
-                next_isoformat = (
-                    datetime.fromtimestamp(next_timestamp).isoformat(" ").split(".")[0]
+            async with sem:
+                next_timestamp = await self.blocked(
+                    puzzle_url, "puzzle", "puzzel game", cooldowns
                 )
-                self.log(
-                    f"{yellow}next time to play puzzel game : {white}{next_isoformat}"
-                )
-            else:
-                _headers = {"User-Agent": "Marin Kitagawa"}
-                res = await self.http(puzzle_answer_url, _headers)
-                tday = datetime.now(tz=timezone.utc).isoformat().split("T")[0]
-                answer = res.json().get(tday)
+                if next_timestamp is not None:
+                    return next_timestamp
+                answer = await puzzle_answer.get(self)
                 if answer is None:
                     self.log(
-                        f"{yellow}The puzzle answers for today have not been updated yet."
+                        f"{yellow}The puzzle answers for today have not been updated yet.",
+                        "warning",
+                        "reward",
+                        game="puzzle",
+                    )
+                    return None
+                res = await self.http(puzzle_url, self.headers, json.dumps(answer))
+                correct = Reward(res.data).correct
+                if len(correct) == 4:
+                    self.log(
+                        f"{green}get reward from puzzle game : {white}5000",
+                        event="reward",
+                        game="puzzle",
+                        reward=5000,
                     )
                 else:
-                    res = await self.http(puzzle_url, self.headers, json.dumps(answer))
-                    correct = res.json().get("correct", "")
-                    if len(correct) == 4:
-                        self.log(f"{green}get reward from puzzle game : {white}5000")
-                    else:
-                        self.log(
-                            f"{red}failed get reward from puzzle game, maybe asnwer is wrong"
-                        )
-            res = await self.http(roulette_url, self.headers)
-            detail = res.json().get("detail")
-            if detail is not None:
-                next_timestamp = int(detail.get("blocked_until"))
-                timestamps.append(next_timestamp)
-                next_isoformat = (
-                    datetime.fromtimestamp(next_timestamp).isoformat(" ").split(".")[0]
-                )
-                self.log(
-                    f"{yellow}next time to play roulette game : {white}{next_isoformat}"
+                    self.log(
+                        f"{red}failed get reward from puzzle game, maybe asnwer is wrong",
+                        "error",
+                        "reward",
+                        game="puzzle",
+                    )
+        return None
+
+    async def roulette(self, cooldowns, sem):
+        roulette_url = "https://major.glados.app/api/roulette/"
+        for i in range(2):
+            async with sem:
+                next_timestamp = await self.blocked(
+                    roulette_url, "roulette", "roulette game", cooldowns
                 )
-            else:
+                if next_timestamp is not None:
+                    return next_timestamp
                 res = await self.http(roulette_url, self.headers, "")
-                reward = res.json().get("rating_award")
-                self.log(f"{green}get reward from roulette : {white}{reward}")
-            res = await self.http(bonus_url, self.headers)
-            detail = res.json().get("detail")
-            if detail is not None:
-                next_timestamp = int(detail.get("blocked_until"))
-                timestamps.append(next_timestamp)
-                next_isoformat = (
-                    datetime.fromtimestamp(next_timestamp).isoformat(" ").split(".")[0]
-                )
+                reward = Reward(res.data).rating_award
                 self.log(
-                    f"{yellow}next time to play hold coin game : {white}{next_isoformat}"
+                    f"{green}get reward from roulette : {white}{reward}",
+                    event="reward",
+                    game="roulette",
+                    reward=reward,
                 )
-            else:
+        return None
+
+    async def hold_coin(self, cooldowns, sem):
+        bonus_url = "https://major.glados.app/api/bonuses/coins/"
+        for i in range(2):
+            async with sem:
+                next_timestamp = await self.blocked(
+                    bonus_url, "hold_coin", "hold coin game", cooldowns
+                )
+                if next_timestamp is not None:
+                    return next_timestamp
                 coin = random.randint(900, 915)
                 bonus_data = {"coins": coin}
                 res = await self.http(bonus_url, self.headers, json.dumps(bonus_data))
-                success = res.json().get("success")
+                success = Reward(res.data).success
                 if success:
-                    self.log(f"{green}get reward from hold coin game : {white}{coin}")
+                    self.log(
+                        f"{green}get reward from hold coin game : {white}{coin}",
+                        event="reward",
+                        game="hold_coin",
+                        reward=coin,
+                    )
                 else:
-                    self.log(f"{red}failed to get reward from hold coin game !")
-            res = await self.http(swipe_coin_url, self.headers)
-            detail = res.json().get("detail")
-            if detail is not None:
-                next_timestamp = int(detail.get("blocked_until"))
-                timestamps.append(next_timestamp)
-                next_isoformat = (
-                    datetime.fromtimestamp(next_timestamp).isoformat(" ").split(".")[0]
-                )
-                self.log(
-                    f"{yellow}next time to play swap game : {white}{next_isoformat}"
+                    self.log(
+                        f"{red}failed to get reward from hold coin game !",
+                        "error",
+                        "reward",
+                        game="hold_coin",
+                    )
+        return None
+
+    async def swipe_coin(self, cooldowns, sem):
+        swipe_coin_url = "https://major.glados.app/api/swipe_coin/"
+        for i in range(2):
+            async with sem:
+                next_timestamp = await self.blocked(
+                    swipe_coin_url, "swipe_coin", "swap game", cooldowns
                 )
-            else:
+                if next_timestamp is not None:
+                    return next_timestamp
                 coin = random.randint(2900, 3000)
                 swipe_data = {"coins": coin}
                 res = await self.http(
                     swipe_coin_url, self.headers, json.dumps(swipe_data)
                 )
-                success = res.json().get("success")
+                success = Reward(res.data).success
                 if success:
-                    self.log(f"{green}get reward from swap game : {white}{coin}")
+                    self.log(
+                        f"{green}get reward from swap game : {white}{coin}",
+                        event="reward",
+                        game="swipe_coin",
+                        reward=coin,
+                    )
                 else:
-                    self.log(f"{red}failed get reward from swap game !")
-            if len(timestamps) >= 3:
-                break
+                    self.log(
+                        f"{red}failed get reward from swap game !",
+                        "error",
+                        "reward",
+                        game="swipe_coin",
+                    )
+        return None
+
+    async def playgame(self):
+        cooldowns = await get_cooldowns(self.user.get("id"))
+        sem = asyncio.Semaphore(game_worker)
+        games = (self.puzzle, self.roulette, self.hold_coin, self.swipe_coin)
+        tasks = [asyncio.ensure_future(game(cooldowns, sem)) for game in games]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        timestamps = [i for i in results if i is not None]
+        if len(timestamps) <= 0:
+            return int(datetime.now().timestamp()) + 3600
         return min(timestamps)
 
 
+class RetryError(Exception):
+    pass
+
+
+class RetryPolicy:
+    def __init__(self, base=1, cap=60, budget=8):
+        self.base = base
+        self.cap = cap
+        self.budget = budget
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.cap)
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown=15, cap=300):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.cap = cap
+        self.failures = 0
+        self.trips = 0
+        self.opened_until = 0
+        self.probing = False
+        self.changed = asyncio.Event()
+
+    async def wait(self):
+        while True:
+            if self.opened_until <= 0:
+                return False
+            delay = self.opened_until - datetime.now().timestamp()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif not self.probing:
+                self.probing = True
+                return True
+            else:
+                await self.changed.wait()
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def release(self):
+        if self.probing:
+            self.probing = False
+            self.notify()
+
+    def success(self):
+        self.failures = 0
+        self.trips = 0
+        if self.opened_until > 0:
+            self.opened_until = 0
+            self.probing = False
+            self.notify()
+
+    def failure(self, probe=False):
+        if self.opened_until > 0 and not probe:
+            return
+        self.failures += 1
+        if self.failures < self.threshold and not probe:
+            return
+        self.failures = 0
+        cooldown = min(self.cap, self.cooldown * 2**self.trips)
+        self.trips += 1
+        self.opened_until = datetime.now().timestamp() + cooldown
+        self.probing = False
+        self.notify()
+        console.emit(
+            "error",
+            "breaker",
+            f"{red}too many failures, pausing requests for {white}{cooldown}s",
+            cooldown=cooldown,
+        )
+
+
+def get_breaker(url):
+    host = httpx.URL(url).host
+    breaker = breakers.get(host)
+    if breaker is None:
+        breaker = breakers[host] = CircuitBreaker()
+    return breaker
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def get_limiter(url):
+    host = httpx.URL(url).host
+    limiter = limiters.get(host)
+    if limiter is None:
+        limiter = limiters[host] = TokenBucket(rate_limit, burst_limit)
+    return limiter
+
+
+def retry_after(res):
+    value = res.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, when.timestamp() - datetime.now(tz=timezone.utc).timestamp())
+
+
+retry_policy = RetryPolicy()
+
+
+def token_exp(token):
+    try:
+        header, payload, sign = token.split(".")
+        deload = urlsafe_b64decode(payload + "==")
+        return int(json.loads(deload).get("exp"))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class TokenRefresher:
+    def __init__(self, scheduler, lead=1800, interval=60, batch=8):
+        self.scheduler = scheduler
+        self.lead = lead
+        self.interval = interval
+        self.batch = batch
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
+
+    async def refresh(self):
+        expiring = set(await get_expiring(datetime.now().timestamp() + self.lead))
+        if len(expiring) <= 0:
+            return
+        bots = []
+        soon = datetime.now().timestamp() + self.interval
+        for uid, (no, query, user) in list(self.scheduler.datas.items()):
+            if uid not in expiring or uid in self.scheduler.running:
+                continue
+            if self.scheduler.due.get(uid, soon) < soon:
+                continue
+            bot = MajTod(
+                no, query, self.scheduler.proxies, self.scheduler.cfg, user=user
+            )
+            bots.append(bot)
+        sem = asyncio.Semaphore(self.batch)
+        results = await asyncio.gather(
+            *[self.renew(sem, bot) for bot in bots], return_exceptions=True
+        )
+        failed = [i for i in results if i is not True]
+        if len(failed) > 0:
+            console.emit(
+                "warning",
+                "refresh",
+                f"{yellow}failed to refresh {white}{len(failed)}{yellow} token !",
+                failed=len(failed),
+            )
+
+    async def renew(self, sem, bot):
+        async with sem:
+            res = await get_by_id(bot.user.get("id"))
+            if res.get("useragent"):
+                bot.headers["user-agent"] = res.get("useragent")
+            token = await bot.login()
+            return bool(token)
+
+
+class PuzzleAnswer:
+    def __init__(self, url, retry=600):
+        self.url = url
+        self.retry = retry
+        self.date = None
+        self.answer = None
+        self.expires = 0
+        self.fetching = None
+
+    async def get(self, requester):
+        tday = datetime.now(tz=timezone.utc).isoformat().split("T")[0]
+        now = datetime.now().timestamp()
+        if self.date == tday and (self.answer is not None or now < self.expires):
+            return self.answer
+        if self.fetching is None:
+            self.fetching = asyncio.create_task(self.fetch(requester, tday))
+        return await asyncio.shield(self.fetching)
+
+    async def fetch(self, requester, tday):
+        try:
+            _headers = {"User-Agent": "Marin Kitagawa"}
+            res = await requester.http(self.url, _headers)
+            self.answer = res.get(tday)
+            self.date = tday
+            self.expires = datetime.now().timestamp() + self.retry
+            return self.answer
+        finally:
+            self.fetching = None
+
+
+puzzle_answer = PuzzleAnswer("https://akasakaid.github.io/major/durov.json")
+
+
+class IpInfo:
+    providers = (
+        ("https://ipapi.co/json/", "ip", "country"),
+        ("https://ipwho.is/", "ip", "country_code"),
+        ("https://freeipapi.com/api/json", "ipAddress", "countryCode"),
+    )
+
+    def __init__(self, ttl=1800, retry=300):
+        self.ttl = ttl
+        self.retry = retry
+        self.cache = {}
+        self.fetching = {}
+
+    async def get(self, proxy):
+        now = datetime.now().timestamp()
+        cached = self.cache.get(proxy)
+        if cached is not None and now < cached[2]:
+            return cached[0], cached[1]
+        if proxy not in self.fetching:
+            self.fetching[proxy] = asyncio.create_task(self.fetch(proxy))
+        return await asyncio.shield(self.fetching[proxy])
+
+    async def lookup(self, proxy, url, ip_key, country_key):
+        try:
+            res = loads((await get_client(proxy).get(url)).content)
+        except (ValueError, httpx.HTTPError, *proxy_errors()):
+            return None
+        if not isinstance(res, dict) or not res.get(ip_key):
+            return None
+        return res.get(ip_key), res.get(country_key)
+
+    async def fetch(self, proxy):
+        tasks = [
+            asyncio.create_task(self.lookup(proxy, *provider))
+            for provider in self.providers
+        ]
+        result = None
+        try:
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                if result is not None:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.fetching.pop(proxy, None)
+        ttl = self.ttl if result is not None else self.retry
+        result = result or (None, None)
+        self.cache[proxy] = (*result, datetime.now().timestamp() + ttl)
+        return result
+
+
+ip_info = IpInfo()
+
+
+def proxy_errors():
+    errors = (httpx.ProxyError,)
+    python_socks = sys.modules.get("python_socks")
+    if python_socks is not None:
+        errors += (
+            python_socks.ProxyTimeoutError,
+            python_socks.ProxyError,
+            python_socks.ProxyConnectionError,
+        )
+    return errors
+
+
+def random_useragent():
+    global useragents
+    if useragents is None:
+        started = time.perf_counter()
+        from fake_useragent import UserAgent
+
+        useragents = UserAgent()
+        elapsed = (time.perf_counter() - started) * 1000
+        console.emit(
+            "info",
+            "startup",
+            f"{green}useragent dataset loaded in {white}{elapsed:.0f} ms",
+            elapsed=elapsed,
+        )
+    return useragents.random
+
+
+def get_client(proxy=None):
+    ses = clients.get(proxy)
+    if ses is not None and not ses.is_closed:
+        return ses
+    cookies = CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+    if proxy is None:
+        ses = httpx.AsyncClient(http2=True, timeout=client_timeout, cookies=cookies)
+    else:
+        from httpx_socks import AsyncProxyTransport
+
+        transport = AsyncProxyTransport.from_url(proxy, http2=True)
+        ses = httpx.AsyncClient(
+            transport=transport, timeout=client_timeout, cookies=cookies
+        )
+    clients[proxy] = ses
+    return ses
+
+
+class ProxyPool:
+    def __init__(
+        self,
+        url="https://major.bot/",
+        interval=60,
+        timeout=10,
+        threshold=3,
+        quarantine=30,
+        cap=900,
+        worker=20,
+    ):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.threshold = threshold
+        self.quarantine = quarantine
+        self.cap = cap
+        self.worker = worker
+        self.proxies = []
+        self.stats = {}
+        self.task = None
+
+    def update(self, proxies):
+        self.proxies = list(proxies)
+        for proxy in self.proxies:
+            if proxy not in self.stats:
+                self.stats[proxy] = {
+                    "rate": 1.0,
+                    "latency": None,
+                    "failures": 0,
+                    "trips": 0,
+                    "until": 0,
+                }
+        for proxy in list(self.stats.keys()):
+            if proxy not in self.proxies:
+                del self.stats[proxy]
+
+    def healthy(self, proxy):
+        stat = self.stats.get(proxy)
+        return stat is None or stat["until"] <= datetime.now().timestamp()
+
+    def rank(self, proxy):
+        stat = self.stats[proxy]
+        latency = stat["latency"] if stat["latency"] is not None else self.timeout
+        return (-round(stat["rate"], 1), latency)
+
+    def best(self, exclude=None):
+        candidates = [i for i in self.proxies if i != exclude] or self.proxies
+        if not candidates:
+            return None
+        healthy = [i for i in candidates if self.healthy(i)]
+        if not healthy:
+            return min(candidates, key=lambda i: self.stats[i]["until"])
+        return min(healthy, key=self.rank)
+
+    def assign(self, id):
+        if not self.proxies:
+            return None
+        proxy = self.proxies[id % len(self.proxies)]
+        if self.healthy(proxy):
+            return proxy
+        return self.best(exclude=proxy)
+
+    def success(self, proxy, latency):
+        stat = self.stats.get(proxy)
+        if stat is None:
+            return
+        stat["rate"] = stat["rate"] * 0.9 + 0.1
+        if stat["latency"] is None:
+            stat["latency"] = latency
+        else:
+            stat["latency"] = stat["latency"] * 0.8 + latency * 0.2
+        stat["failures"] = 0
+        stat["trips"] = 0
+        stat["until"] = 0
+
+    def failure(self, proxy):
+        stat = self.stats.get(proxy)
+        if stat is None:
+            return
+        stat["rate"] = stat["rate"] * 0.9
+        stat["failures"] += 1
+        if stat["failures"] < self.threshold:
+            return
+        stat["failures"] = 0
+        quarantine = min(self.cap, self.quarantine * 2 ** stat["trips"])
+        stat["trips"] += 1
+        stat["until"] = datetime.now().timestamp() + quarantine
+        console.emit(
+            "warning",
+            "proxy",
+            f"{yellow}proxy quarantined for {white}{quarantine}s",
+            proxy=proxy,
+            quarantine=quarantine,
+        )
+
+    async def check(self, proxy, sem):
+        async with sem:
+            started = time.monotonic()
+            try:
+                res = await get_client(proxy).get(self.url, timeout=self.timeout)
+            except (httpx.HTTPError, anyio.EndOfStream, *proxy_errors()):
+                self.failure(proxy)
+                return
+            if res.status_code in (403, 407) or res.status_code >= 500:
+                self.failure(proxy)
+                return
+            self.success(proxy, time.monotonic() - started)
+
+    async def run(self):
+        sem = asyncio.Semaphore(self.worker)
+        while True:
+            proxies = [i for i in self.proxies if self.healthy(i)]
+            await asyncio.gather(*[self.check(i, sem) for i in proxies])
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        task, self.task = self.task, None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+proxy_pool = ProxyPool()
+
+
+async def close_clients(keep=None):
+    for proxy in list(clients.keys()):
+        if keep is not None and (proxy is None or proxy in keep):
+            continue
+        ses = clients.pop(proxy)
+        await ses.aclose()
+
+
+class LogSink:
+    def __init__(self, path, max_size=1024 * 1024, backups=5, batch=256):
+        self.path = path
+        self.max_size = max_size
+        self.backups = backups
+        self.batch = batch
+        self.queue = asyncio.Queue(maxsize=batch * 64)
+        self.size = 0
+        self.dropped = 0
+        self.reported = 0
+        self.task = None
+
+    def write(self, text):
+        if self.task is None:
+            return
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.drop(self.path)
+
+    def report(self):
+        dropped = self.dropped - self.reported
+        if dropped <= 0:
+            return
+        self.reported = self.dropped
+        console.emit(
+            "warning",
+            "log",
+            f"{yellow}dropped {white}{dropped}{yellow} lines from {white}{self.path}",
+            path=self.path,
+            dropped=dropped,
+        )
+
+    async def start(self):
+        if self.task is not None:
+            return
+        if await aiofiles.ospath.exists(self.path):
+            self.size = await aiofiles.ospath.getsize(self.path)
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            lines = [await self.queue.get()]
+            while len(lines) < self.batch and not self.queue.empty():
+                lines.append(self.queue.get_nowait())
+            closing = None in lines
+            lines = [i for i in lines if i is not None]
+            if lines:
+                chunk = "\n".join(lines) + "\n"
+                async with aiofiles.open(self.path, "a", encoding="utf-8") as w:
+                    await w.write(chunk)
+                self.size += len(chunk.encode("utf-8"))
+                if self.size > self.max_size:
+                    await self.rotate()
+            if closing:
+                return
+
+    async def rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}.gz"
+            if await aiofiles.ospath.exists(src):
+                await aiofiles.os.replace(src, f"{self.path}.{i + 1}.gz")
+        await asyncio.to_thread(self.compress, self.path, f"{self.path}.1.gz")
+        self.size = 0
+        self.report()
+
+    @staticmethod
+    def compress(src, dst):
+        with open(src, "rb") as r, gzip.open(dst, "wb") as w:
+            shutil.copyfileobj(r, w)
+        open(src, "w").close()
+
+    async def close(self):
+        if self.task is None:
+            return
+        task, self.task = self.task, None
+        await self.queue.put(None)
+        await task
+        self.report()
+
+
+http_log = LogSink(log_file)
+exporter = None
+
+
+def start_exporter(path, interval):
+    global exporter
+    if path and exporter is None:
+        exporter = asyncio.create_task(metrics.export(path, interval))
+
+
+async def stop_exporter():
+    global exporter
+    if exporter is None:
+        return
+    task, exporter = exporter, None
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
 async def countdown(t):
     for i in range(t, 0, -1):
         minute, seconds = divmod(i, 60)
@@ -378,27 +1103,385 @@ async def countdown(t):
         seconds = str(seconds).zfill(2)
         minute = str(minute).zfill(2)
         hour = str(hour).zfill(2)
-        print(f"waiting for {hour}:{minute}:{seconds} ", flush=True, end="\r")
+        console.set_status(f"waiting for {hour}:{minute}:{seconds}")
         await asyncio.sleep(1)
+    console.set_status(None)
+
+
+class Registry:
+    def __init__(self):
+        self.version = 0
+        self.data_key = None
+        self.proxy_key = None
+        self.parsed = {}
+        self.datas = []
+        self.proxies = []
+
+    async def changed(self, path, key):
+        stat = await aiofiles.os.stat(path)
+        new_key = (path, stat.st_mtime_ns, stat.st_size)
+        return new_key if new_key != key else None
+
+    async def load(self, data_file, proxy_file):
+        data_key = await self.changed(data_file, self.data_key)
+        if data_key is not None:
+            async with aiofiles.open(data_file) as w:
+                read = await w.read()
+            parsed = {}
+            users = {}
+            for no, query in enumerate(read.splitlines()):
+                if len(query) <= 10:
+                    continue
+                if query in self.parsed:
+                    user = self.parsed[query]
+                else:
+                    user = parse_user(query)
+                parsed[query] = user
+                if user is None:
+                    console.emit(
+                        "error",
+                        "data",
+                        f"{red}line {no + 1} of {data_file} has wrong format !",
+                        line=no + 1,
+                    )
+                    continue
+                users[user["id"]] = (query, user)
+            self.parsed = parsed
+            self.datas = list(users.values())
+            self.data_key = data_key
+        proxy_key = await self.changed(proxy_file, self.proxy_key)
+        if proxy_key is not None:
+            async with aiofiles.open(proxy_file) as w:
+                read = await w.read()
+            self.proxies = [i for i in read.splitlines() if len(i) > 5]
+            self.proxy_key = proxy_key
+        if data_key is not None or proxy_key is not None:
+            self.version += 1
+        return self.datas, self.proxies
+
+
+registry = Registry()
 
 
 async def get_data():
-    async with aiofiles.open(data_file) as w:
-        read = await w.read()
-        datas = [i for i in read.splitlines() if len(i) > 10]
-    async with aiofiles.open(proxy_file) as w:
-        read = await w.read()
-        proxies = [i for i in read.splitlines() if len(i) > 5]
+    datas, proxies = await registry.load(data_file, proxy_file)
+    if proxies != proxy_pool.proxies:
+        proxy_pool.update(proxies)
     return datas, proxies
 
 
-async def bound(sem, data):
-    async with sem:
-        return await MajTod(*data).start()
+class Concurrency:
+    def __init__(self, limit=1, maximum=max_worker, window=10, samples=1024):
+        self.limit = limit
+        self.maximum = maximum
+        self.window = window
+        self.samples = samples
+        self.active = 0
+        self.busy = 0
+        self.baseline = None
+        self.cond = asyncio.Condition()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.errors = 0
+        self.limited = 0
+        self.latencies = deque(maxlen=self.samples)
+
+    def resize(self, limit, maximum=None):
+        if maximum is not None:
+            self.maximum = max(1, maximum)
+        self.limit = max(1, min(self.maximum, limit))
+
+    async def acquire(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def release(self):
+        async with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def record(self, latency=None, error=False, limited=False):
+        self.requests += 1
+        if latency is not None:
+            self.latencies.append(latency)
+        if error:
+            self.errors += 1
+        if limited:
+            self.limited += 1
+
+    def adjust(self):
+        if self.requests <= 0:
+            return
+        latency = None
+        if self.latencies:
+            latency = sorted(self.latencies)[len(self.latencies) // 2]
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+            else:
+                self.baseline = self.baseline * 0.9 + latency * 0.1
+        slow = latency is not None and latency > self.baseline * 3
+        failing = self.limited > 0 or self.errors / self.requests > 0.05
+        limit = self.limit
+        if failing or slow:
+            self.resize(int(self.limit / 2))
+        elif self.busy >= self.limit:
+            self.resize(self.limit + 1)
+        if self.limit != limit:
+            console.emit(
+                "info",
+                "worker",
+                f"{green}worker : {white}{self.limit}/{self.maximum} "
+                f"{green}requests : {white}{self.requests} "
+                f"{green}errors : {white}{self.errors} "
+                f"{green}rate limited : {white}{self.limited}",
+                worker=self.limit,
+                maximum=self.maximum,
+                requests=self.requests,
+                errors=self.errors,
+                limited=self.limited,
+            )
+        self.reset()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.window)
+            self.adjust()
+            async with self.cond:
+                self.cond.notify_all()
+
+
+controller = Concurrency()
+
+
+class Scheduler:
+    def __init__(self, controller, cfg, reload_interval=60, shard=(0, 1)):
+        self.controller = controller
+        self.shard = shard
+        self.version = None
+        self.runs = 0
+        self.failed = 0
+        self.cfg = cfg
+        self.reload_interval = reload_interval
+        self.heap = []
+        self.datas = {}
+        self.due = {}
+        self.running = set()
+        self.proxies = []
+        self.idle = 0
+        self.announced = None
+        self.wakeup = asyncio.Event()
+
+    def push(self, due, uid):
+        self.due[uid] = due
+        heapq.heappush(self.heap, (due, uid))
+        self.wakeup.set()
+
+    async def reload(self):
+        datas, proxies = await get_data()
+        if registry.version == self.version:
+            return
+        self.version = registry.version
+        await close_clients(keep=proxies)
+        index, total = self.shard
+        datas = {
+            user["id"]: (no, query, user)
+            for no, (query, user) in enumerate(datas)
+            if user["id"] % total == index
+        }
+        now = int(datetime.now().timestamp())
+        for uid in datas:
+            if uid not in self.due and uid not in self.running:
+                self.push(now, uid)
+        self.datas = datas
+        self.proxies = proxies
+
+    async def next(self):
+        while True:
+            now = int(datetime.now().timestamp())
+            if self.heap and self.heap[0][0] <= now:
+                due, uid = heapq.heappop(self.heap)
+                if self.due.get(uid) != due:
+                    continue
+                del self.due[uid]
+                if uid in self.datas:
+                    return uid
+                continue
+            timeout = self.heap[0][0] - now if self.heap else None
+            self.idle += 1
+            if (
+                self.idle >= self.controller.active
+                and self.announced != self.heap[:1]
+            ):
+                self.announced = self.heap[:1]
+                try:
+                    await flush()
+                except sqlite3.OperationalError:
+                    pass
+                except sqlite3.DatabaseError as e:
+                    console.emit(
+                        "error", "database", f"{red}failed to flush : {white}{e!r}"
+                    )
+                if timeout is not None:
+                    next_isoformat = (
+                        datetime.fromtimestamp(self.heap[0][0])
+                        .isoformat(" ")
+                        .split(".")[0]
+                    )
+                    console.emit(
+                        "info",
+                        "schedule",
+                        f"{yellow}next account due at : {white}{next_isoformat}",
+                        next_due=self.heap[0][0],
+                    )
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.idle -= 1
+
+    async def work(self):
+        while True:
+            await self.controller.acquire()
+            try:
+                uid = await self.next()
+                self.running.add(uid)
+                no, query, user = self.datas[uid]
+                self.controller.busy += 1
+                try:
+                    bot = MajTod(no, query, self.proxies, self.cfg, user=user)
+                    due = await bot.start()
+                except Exception as e:
+                    console.emit(
+                        "error", "account", f"{red}failed : {white}{e!r}", account=no + 1
+                    )
+                    self.failed += 1
+                    due = int(datetime.now().timestamp()) + self.reload_interval
+                finally:
+                    self.controller.busy -= 1
+                self.runs += 1
+                self.running.discard(uid)
+                self.push(due, uid)
+            finally:
+                await self.controller.release()
+
+    async def run(self):
+        await self.reload()
+        workers = [
+            asyncio.create_task(self.work()) for _ in range(self.controller.maximum)
+        ]
+        workers.append(asyncio.create_task(TokenRefresher(self).run()))
+        workers.append(asyncio.create_task(self.controller.run()))
+        try:
+            while True:
+                await asyncio.sleep(self.reload_interval)
+                await self.reload()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "accounts": len(self.datas),
+            "runs": self.runs,
+            "failed": self.failed,
+            "worker": self.controller.limit,
+            "next_due": self.heap[0][0] if self.heap else None,
+        }
+
+
+def shard_main(index, total, options, queue):
+    global data_file, proxy_file, rate_limit, burst_limit, http_log
+    data_file = options["data_file"]
+    proxy_file = options["proxy_file"]
+    rate_limit = options["rate"] / total
+    burst_limit = max(1, options["burst"] // total)
+    http_log = LogSink(f"http.{index}.log")
+    console.mode = options["console"]
+    if options["metrics"]:
+        stem, ext = os.path.splitext(options["metrics"])
+        options["metrics"] = f"{stem}.{index}{ext}"
+    controller.resize(1, maximum=max(1, options["worker"] // total))
+    try:
+        asyncio.run(shard_run(index, total, options, queue))
+    except KeyboardInterrupt:
+        pass
+
+
+async def shard_run(index, total, options, queue):
+    await init()
+    await http_log.start()
+    await console.start()
+    start_exporter(options["metrics"], options["metrics_interval"])
+    proxy_pool.start()
+    scheduler = Scheduler(controller, options["cfg"], shard=(index, total))
+
+    async def report():
+        while True:
+            await asyncio.sleep(10)
+            queue.put((index, scheduler.stats()))
+
+    reporter = asyncio.create_task(report())
+    try:
+        await scheduler.run()
+    finally:
+        reporter.cancel()
+        await stop_exporter()
+        await proxy_pool.stop()
+        await close_clients()
+        await http_log.close()
+        await close()
+        await console.close()
+
+
+async def run_shards(total, options):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    procs = [
+        ctx.Process(target=shard_main, args=(index, total, options, queue))
+        for index in range(total)
+    ]
+    for proc in procs:
+        proc.start()
+    stats = {}
+    try:
+        while any(proc.is_alive() for proc in procs):
+            try:
+                index, stat = await asyncio.to_thread(queue.get, True, 5)
+            except Empty:
+                continue
+            stats[index] = stat
+            dues = [i["next_due"] for i in stats.values() if i["next_due"]]
+            next_isoformat = "-"
+            if dues:
+                next_isoformat = (
+                    datetime.fromtimestamp(min(dues)).isoformat(" ").split(".")[0]
+                )
+            console.emit(
+                "info",
+                "shards",
+                f"{green}shard : {white}{len(stats)}/{total} "
+                f"{green}accounts : {white}{sum(i['accounts'] for i in stats.values())} "
+                f"{green}runs : {white}{sum(i['runs'] for i in stats.values())} "
+                f"{green}failed : {white}{sum(i['failed'] for i in stats.values())} "
+                f"{green}worker : {white}{sum(i['worker'] for i in stats.values())} "
+                f"{green}next due : {white}{next_isoformat}",
+                stats=stats,
+            )
+    finally:
+        for proc in procs:
+            await asyncio.to_thread(proc.join, 10)
+            if proc.is_alive():
+                proc.terminate()
 
 
 async def main():
-    global data_file, proxy_file
+    global data_file, proxy_file, rate_limit, burst_limit
     temp_worker = os.cpu_count() / 2
     arg = argparse.ArgumentParser()
     arg.add_argument("--marin", action="store_true")
@@ -412,10 +1495,67 @@ async def main():
         help="A file containing a list of proxies",
     )
     arg.add_argument("--action", "-A", help="Argument to select the menu directly")
-    arg.add_argument("--worker", "-W", type=int, help="Worker")
+    arg.add_argument(
+        "--worker",
+        "-W",
+        type=int,
+        help=f"Max number of accounts running at the same time (default {max_worker})",
+    )
+    arg.add_argument(
+        "--process",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes for the sharded mode",
+    )
+    arg.add_argument(
+        "--rate",
+        "-R",
+        type=float,
+        default=rate_limit,
+        help="Max requests per second for each api host (0 to disable)",
+    )
+    arg.add_argument(
+        "--burst",
+        "-B",
+        type=int,
+        default=burst_limit,
+        help="Max burst of requests for each api host",
+    )
+    arg.add_argument(
+        "--quiet",
+        "-Q",
+        action="store_true",
+        help="Only print warnings, errors and a periodic summary",
+    )
+    arg.add_argument(
+        "--json", action="store_true", help="Print log events as json lines"
+    )
+    arg.add_argument(
+        "--metrics",
+        "-M",
+        help="Write metrics to this file (.json for a json snapshot, prometheus text otherwise)",
+    )
+    arg.add_argument(
+        "--metrics-interval",
+        type=int,
+        default=15,
+        help="Seconds between metrics file updates",
+    )
     args = arg.parse_args()
     proxy_file = args.proxy
     data_file = args.data
+    rate_limit = args.rate
+    if args.json:
+        console.mode = "json"
+    elif args.quiet:
+        console.mode = "quiet"
+    out = sys.stdout if console.mode == "text" else sys.stderr
+
+    def ask(prompt):
+        print(prompt, end="", file=out, flush=True)
+        return input()
+
+    burst_limit = max(1, args.burst)
     opt = args.action
     worker = args.worker
     banner = f"""{Fore.GREEN}
@@ -438,77 +1578,128 @@ async def main():
     if not await aiofiles.ospath.exists(config_file):
         async with aiofiles.open(config_file, "w") as w:
             await w.write(json.dumps({"auto_task": True}))
+    startup = None
     while True:
-        if not args.marin:
+        if not args.marin and console.mode == "text":
             os.system("cls" if os.name == "nt" else "clear")
         if not worker:
-            worker = int(os.cpu_count() / 2)
-            if worker < 1:
-                worker = 1
-        sem = asyncio.Semaphore(worker)
+            worker = max_worker
+        controller.resize(
+            max(controller.limit, int((os.cpu_count() or 2) / 2)), maximum=worker
+        )
         async with aiofiles.open(config_file, "r") as r:
             read = await r.read()
             config = json.loads(read)
             cfg = Config(auto_task=config.get("auto_task", True))
         datas, proxies = await get_data()
+        if startup is None:
+            startup = time.perf_counter() - boot
+        summary = await get_summary()
+        earnings = ""
+        if summary is not None:
+            earnings = f"""
+{green}total balance : {white}{summary['balance']} {green}today : {white}{summary['today']:+} {green}avg/day : {white}{summary['average']:+.0f}"""
         menu = f"""
 {green}data file :{white} {data_file}
 {green}proxy file :{white} {proxy_file}
 {green}total data : {white}{len(datas)}
 {green}total proxy : {white}{len(proxies)}
+{green}worker : {white}{controller.limit}/{controller.maximum} {green}(adaptive)
+{green}startup : {white}{import_time * 1000:.0f} ms {green}imports, {white}{startup * 1000:.0f} ms {green}to menu{earnings}
 
     {green}1{white}. set on/off auto task ({(green + "active" if cfg.auto_task else red + "non-active")}{reset})
     {green}2{white}. start bot {green}(multi proses)
     {green}3{white}. start bot {green}(single proses)
+    {green}4{white}. start bot {green}(sharded, {args.process} proses)
         """
-        print(banner)
-        print(menu)
+        print(banner, file=out)
+        print(menu, file=out)
         if not opt:
-            opt = input(f"{green}input number : {white}") or None
-            print(line)
+            opt = ask(f"{green}input number : {white}") or None
+            print(line, file=out)
             if not opt:
-                print(f"{yellow}please input correct number !")
-                input(f"{blue}press enter to continue !")
+                print(f"{yellow}please input correct number !", file=out)
+                ask(f"{blue}press enter to continue !")
                 continue
         if opt == "1":
             async with aiofiles.open(config_file, "w") as w:
                 config["auto_task"] = False if cfg.auto_task else True
                 await w.write(json.dumps(config, indent=4))
-            print(f"{green}success update auto_task config !")
-            input(f"{blue}press enter to continue !")
+            print(f"{green}success update auto_task config !", file=out)
+            ask(f"{blue}press enter to continue !")
             opt = None
             continue
         elif opt == "2":
             await init()
+            await http_log.start()
+            await console.start()
+            start_exporter(args.metrics, args.metrics_interval)
+            proxy_pool.start()
             if len(datas) <= 0:
-                print(f"{red}fill your data in {data_file} first !")
+                print(f"{red}fill your data in {data_file} first !", file=out)
                 exit()
-            while True:
-                datas, proxies = await get_data()
-                tasks = [
-                    asyncio.create_task(bound(sem, (no, data, proxies, cfg)))
-                    for no, data in enumerate(datas)
-                ]
-                results = await asyncio.gather(*tasks)
-                _now = int(datetime.now().timestamp())
-                await countdown(min(results) - _now)
+            await Scheduler(controller, cfg).run()
         elif opt == "3":
             await init()
+            await http_log.start()
+            await console.start()
+            start_exporter(args.metrics, args.metrics_interval)
+            proxy_pool.start()
             if len(datas) <= 0:
-                print(f"{red}fill your data in {data_file} first !")
+                print(f"{red}fill your data in {data_file} first !", file=out)
                 exit()
             while True:
                 datas, proxies = await get_data()
+                await close_clients(keep=proxies)
                 countdowns = []
-                for no, data in enumerate(datas):
-                    result = await MajTod(no, data, proxies, cfg).start()
+                for no, (query, user) in enumerate(datas):
+                    try:
+                        bot = MajTod(no, query, proxies, cfg, user=user)
+                        result = await bot.start()
+                    except RetryError as e:
+                        console.emit(
+                            "error", "account", f"{red}failed : {white}{e}", account=no + 1
+                        )
+                        continue
                     countdowns.append(result)
+                await flush()
                 now = int(datetime.now().timestamp())
-                await countdown(min(countdowns) - now)
+                await countdown(min(countdowns, default=now + 60) - now)
+        elif opt == "4":
+            await init()
+            await close()
+            if len(datas) <= 0:
+                print(f"{red}fill your data in {data_file} first !", file=out)
+                exit()
+            options = {
+                "data_file": data_file,
+                "proxy_file": proxy_file,
+                "rate": rate_limit,
+                "burst": burst_limit,
+                "worker": worker,
+                "cfg": cfg,
+                "console": console.mode,
+                "metrics": args.metrics,
+                "metrics_interval": args.metrics_interval,
+            }
+            await run_shards(max(1, args.process), options)
+            exit()
+
+
+async def run():
+    try:
+        await main()
+    finally:
+        await stop_exporter()
+        await proxy_pool.stop()
+        await close_clients()
+        await http_log.close()
+        await close()
+        await console.close()
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        asyncio.run(run())
     except KeyboardInterrupt:
         exit()
@@ -0,0 +1,126 @@
+import re
+import sys
+import json
+import time
+import asyncio
+from datetime import datetime
+from colorama import Fore, Style
+
+red = Fore.LIGHTRED_EX
+blue = Fore.LIGHTBLUE_EX
+green = Fore.LIGHTGREEN_EX
+yellow = Fore.LIGHTYELLOW_EX
+black = Fore.LIGHTBLACK_EX
+white = Fore.LIGHTWHITE_EX
+reset = Style.RESET_ALL
+ansi = re.compile(r"\x1b\[[0-9;]*m")
+levels = ("info", "warning", "error")
+
+
+class Console:
+    def __init__(self, mode="text", interval=1, summary_interval=60, batch=256):
+        self.mode = mode
+        self.interval = interval
+        self.summary_interval = summary_interval
+        self.batch = batch
+        self.queue = asyncio.Queue()
+        self.counts = {level: 0 for level in levels}
+        self.status = None
+        self.shown = None
+        self.task = None
+
+    def emit(self, level, event, msg, account=None, **fields):
+        record = {
+            "time": time.time(),
+            "level": level,
+            "event": event,
+            "account": account,
+            "msg": msg,
+            **fields,
+        }
+        if self.task is None:
+            self.render(record)
+            return
+        self.queue.put_nowait(record)
+
+    def set_status(self, status):
+        self.status = status
+
+    def clear(self):
+        if self.shown is not None:
+            print("\r\x1b[K", end="")
+            self.shown = None
+
+    def render(self, record):
+        self.counts[record["level"]] = self.counts.get(record["level"], 0) + 1
+        if self.mode == "json":
+            record = dict(record, msg=ansi.sub("", record["msg"]))
+            print(json.dumps(record, default=str))
+            return
+        if self.mode == "quiet" and record["level"] == "info":
+            return
+        self.clear()
+        now = datetime.fromtimestamp(record["time"]).strftime("%H:%M:%S")
+        if record["account"] is None:
+            print(f"{black}[{now}]{white} {record['msg']}{reset}")
+            return
+        print(
+            f"{black}[{now}]{white}-{blue}[{white}acc {record['account']}{blue}]{white} {record['msg']}{reset}"
+        )
+
+    def summary(self):
+        return (
+            f"{green}info : {white}{self.counts['info']} "
+            f"{yellow}warning : {white}{self.counts['warning']} "
+            f"{red}error : {white}{self.counts['error']}"
+            + (f" {white}| {self.status}" if self.status else "")
+            + reset
+        )
+
+    def render_status(self):
+        if self.mode != "text" or not sys.stdout.isatty():
+            return
+        summary = self.summary()
+        if summary == self.shown:
+            return
+        self.shown = summary
+        print(f"\r\x1b[K{summary}", end="", flush=True)
+
+    async def run(self):
+        last = 0
+        last_summary = time.monotonic()
+        while True:
+            try:
+                records = [await asyncio.wait_for(self.queue.get(), self.interval)]
+            except asyncio.TimeoutError:
+                records = []
+            while len(records) < self.batch and not self.queue.empty():
+                records.append(self.queue.get_nowait())
+            closing = None in records
+            for record in records:
+                if record is not None:
+                    self.render(record)
+            if closing:
+                self.clear()
+                return
+            now = time.monotonic()
+            if self.mode == "quiet" and now - last_summary >= self.summary_interval:
+                last_summary = now
+                print(ansi.sub("", self.summary()), flush=True)
+            if now - last >= self.interval:
+                last = now
+                self.render_status()
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self.task is None:
+            return
+        task, self.task = self.task, None
+        await self.queue.put(None)
+        await task
+
+
+console = Console()
@@ -1,10 +1,13 @@
+import io
+import csv
+import json
 import asyncio
+import argparse
 import aiofiles
-from models import get_all
+from html import escape
+from models import iter_accounts, get_summary, migrate, close
 
-
-async def main():
-    start_html = """
+start_html = """
 <!DOCTYPE html>
 <html lang="id">
 
@@ -36,17 +39,28 @@ async def main():
                     </tr>
                 </thead>
                 <tbody>
-
 """
-    end_html = (
-        lambda total: """
+end_html = (
+    lambda summary: """
                 </tbody>
                 <tfoot class="table-light">
                     <tr>
                         <td colspan="2" class="text-end">Total Balance:</td>
                         <td class="text-end" id="totalBalance">"""
-        + str(total)
-        + """</td>
+    + str(summary["balance"])
+    + """</td>
+                    </tr>
+                    <tr>
+                        <td colspan="2" class="text-end">Earned Today:</td>
+                        <td class="text-end" id="earnedToday">"""
+    + str(summary["today"])
+    + """</td>
+                    </tr>
+                    <tr>
+                        <td colspan="2" class="text-end">Daily Average:</td>
+                        <td class="text-end" id="dailyAverage">"""
+    + str(round(summary["average"], 2))
+    + """</td>
                     </tr>
                 </tfoot>
             </table>
@@ -88,22 +102,79 @@ async def main():
 
 </html>
 """
-    )
-    tot = 0
-    datas = await get_all()
-    for i in datas:
-        tot += float(i["balance"])
-        start_html += f"""
+)
+
+
+def html_rows(rows):
+    return "".join(
+        f"""
 <tr>
     <td>{i['id']}</td>
-    <td>{i['first_name']}</td>
+    <td>{escape(str(i['first_name']))}</td>
     <td>{i['balance']}</td>
 </tr>"""
-    print(f"total account : {len(datas)}")
-    print(f"total balance : {tot}")
-    async with aiofiles.open("report.html", "w", encoding="utf-8") as w:
-        await w.write(start_html + end_html(tot))
-    print(f"report results in the form of an html file: report.html")
+        for i in rows
+    )
+
+
+def csv_rows(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerows([i["id"], i["first_name"], i["balance"]] for i in rows)
+    return out.getvalue()
+
+
+def json_rows(rows, first):
+    out = ",".join(json.dumps(i, ensure_ascii=False) for i in rows)
+    return out if first else "," + out
+
+
+async def main():
+    arg = argparse.ArgumentParser()
+    arg.add_argument(
+        "--format", "-F", choices=("html", "csv", "json"), default="html"
+    )
+    arg.add_argument("--output", "-O", help="Output file, default report.<format>")
+    arg.add_argument(
+        "--chunk", type=int, default=1000, help="Rows fetched per database read"
+    )
+    args = arg.parse_args()
+    output = args.output or f"report.{args.format}"
+    await migrate()
+    summary = await get_summary()
+    try:
+        async with aiofiles.open(output, "w", encoding="utf-8", newline="") as w:
+            if args.format == "html":
+                await w.write(start_html)
+            elif args.format == "csv":
+                await w.write("id,first_name,balance\r\n")
+            else:
+                await w.write(
+                    f'{{"total_account": {summary["accounts"]}, '
+                    f'"total_balance": {json.dumps(summary["balance"])}, '
+                    f'"daily": {json.dumps(summary["daily"])}, "accounts": ['
+                )
+            first = True
+            async for rows in iter_accounts(args.chunk):
+                if args.format == "html":
+                    await w.write(html_rows(rows))
+                elif args.format == "csv":
+                    await w.write(csv_rows(rows))
+                else:
+                    await w.write(json_rows(rows, first))
+                first = False
+            if args.format == "html":
+                await w.write(end_html(summary))
+            elif args.format == "json":
+                await w.write("]}\n")
+    finally:
+        await close()
+    print(f"total account : {summary['accounts']}")
+    print(f"total balance : {summary['balance']}")
+    print(f"earned today : {summary['today']}")
+    for i in summary["daily"]:
+        print(f"{i['day']} : {i['delta']:+} ({i['updates']} updates)")
+    print(f"report results in the form of a {args.format} file: {output}")
 
 
 asyncio.run(main())
@@ -0,0 +1,160 @@
+import os
+import re
+import json
+import time
+import asyncio
+import aiofiles
+from urllib.parse import urlsplit
+
+buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+numeric = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint(url):
+    parts = urlsplit(str(url))
+    return parts.netloc + numeric.sub("/{id}", parts.path)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        out = []
+        total = 0
+        for count in self.counts:
+            total += count
+            out.append(total)
+        return out
+
+    def snapshot(self):
+        return {
+            "buckets": dict(zip(map(str, buckets), self.cumulative())),
+            "sum": round(self.sum, 6),
+            "count": self.count,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.requests = {}
+        self.latency = {}
+        self.retries = {}
+        self.errors = {}
+        self.dropped = {}
+        self.cycle_seconds = Histogram()
+        self.cycles = {}
+
+    def request(self, url, latency, result):
+        name = endpoint(url)
+        key = (name, result)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if name not in self.latency:
+            self.latency[name] = Histogram()
+        self.latency[name].observe(latency)
+
+    def retry(self, url):
+        name = endpoint(url)
+        self.retries[name] = self.retries.get(name, 0) + 1
+
+    def error(self, url, error):
+        key = (endpoint(url), error)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def drop(self, path):
+        self.dropped[path] = self.dropped.get(path, 0) + 1
+
+    def cycle(self, account, duration):
+        self.cycle_seconds.observe(duration)
+        self.cycles[account] = round(duration, 3)
+
+    def snapshot(self):
+        return {
+            "time": time.time(),
+            "uptime": round(time.time() - self.started, 3),
+            "requests": [
+                {"endpoint": name, "result": result, "count": count}
+                for (name, result), count in self.requests.items()
+            ],
+            "latency": {
+                name: histogram.snapshot() for name, histogram in self.latency.items()
+            },
+            "retries": self.retries,
+            "errors": [
+                {"endpoint": name, "error": error, "count": count}
+                for (name, error), count in self.errors.items()
+            ],
+            "log_dropped": self.dropped,
+            "cycle": self.cycle_seconds.snapshot(),
+            "accounts": self.cycles,
+        }
+
+    def prometheus(self):
+        lines = ["# TYPE major_requests_total counter"]
+        for (name, result), count in self.requests.items():
+            lines.append(
+                f'major_requests_total{{endpoint="{name}",result="{result}"}} {count}'
+            )
+        lines.append("# TYPE major_request_seconds histogram")
+        for name, histogram in self.latency.items():
+            lines.extend(histogram_lines("major_request_seconds", histogram, name))
+        lines.append("# TYPE major_retries_total counter")
+        for name, count in self.retries.items():
+            lines.append(f'major_retries_total{{endpoint="{name}"}} {count}')
+        lines.append("# TYPE major_errors_total counter")
+        for (name, error), count in self.errors.items():
+            lines.append(
+                f'major_errors_total{{endpoint="{name}",error="{error}"}} {count}'
+            )
+        lines.append("# TYPE major_log_dropped_total counter")
+        for path, count in self.dropped.items():
+            lines.append(f'major_log_dropped_total{{file="{path}"}} {count}')
+        lines.append("# TYPE major_cycle_seconds histogram")
+        lines.extend(histogram_lines("major_cycle_seconds", self.cycle_seconds))
+        return "\n".join(lines) + "\n"
+
+    async def write(self, path):
+        if path.endswith(".json"):
+            content = json.dumps(self.snapshot(), indent=2)
+        else:
+            content = self.prometheus()
+        temp = f"{path}.tmp"
+        async with aiofiles.open(temp, "w", encoding="utf-8") as w:
+            await w.write(content)
+        os.replace(temp, path)
+
+    async def export(self, path, interval=15):
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.write(path)
+        finally:
+            await self.write(path)
+
+
+def histogram_lines(metric, histogram, name=None):
+    label = f'endpoint="{name}",' if name is not None else ""
+    lines = []
+    for bound, count in zip(buckets, histogram.cumulative()):
+        lines.append(f'{metric}_bucket{{{label}le="{bound}"}} {count}')
+    lines.append(f'{metric}_bucket{{{label}le="+Inf"}} {histogram.count}')
+    label = f'{{endpoint="{name}"}}' if name is not None else ""
+    lines.append(f"{metric}_sum{label} {histogram.sum}")
+    lines.append(f"{metric}_count{label} {histogram.count}")
+    return lines
+
+
+metrics = Metrics()
@@ -1,122 +1,639 @@
 import asyncio
+import sqlite3
 import aiosqlite
 from pathlib import Path
+from datetime import datetime, timezone
+from console import console, red, white
 
 loop = asyncio.new_event_loop()
 database = Path(__file__).parent.joinpath("database.sqlite3")
+pragmas = (
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA foreign_keys = true;",
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA cache_size = -16000;",
+)
+flush_size = 200
+flush_interval = 5
+_db = None
+_pending = {}
+_cache = {}
+_cooldowns = {}
+_pending_cooldowns = {}
+_tasks = {}
+_pending_tasks = {}
+_pending_history = []
+_flusher = None
+_db_lock = asyncio.Lock()
+_write_lock = asyncio.Lock()
+
+
+async def connect():
+    global _db
+    if _db is not None:
+        return _db
+    async with _db_lock:
+        if _db is None:
+            db = await aiosqlite.connect(database=database)
+            db.row_factory = aiosqlite.Row
+            for pragma in pragmas:
+                await db.execute(pragma)
+            _db = db
+    return _db
+
+
+async def close():
+    global _db, _db_lock, _write_lock, _flusher
+    if _flusher is not None:
+        task, _flusher = _flusher, None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    if _db is None:
+        return
+    await flush()
+    db, _db = _db, None
+    await db.close()
+    _cache.clear()
+    _cooldowns.clear()
+    _tasks.clear()
+    _db_lock = asyncio.Lock()
+    _write_lock = asyncio.Lock()
+
+
+async def write(query, values=()):
+    db = await connect()
+    async with _write_lock:
+        await db.execute(query, values)
+        await db.commit()
+
+
+def to_account(res):
+    return {
+        "id": res["id"],
+        "first_name": res["first_name"],
+        "balance": res["balance"],
+        "token": res["token"],
+        "token_exp": res["token_exp"],
+        "useragent": res["useragent"],
+    }
+
+
+async def load_cache():
+    query = """
+    SELECT * FROM "main"."accounts"
+    """
+    db = await connect()
+    async with db.execute(query) as cur:
+        result = await cur.fetchall()
+    _cache.clear()
+    for res in result:
+        _cache[res["id"]] = to_account(res)
+    return len(_cache)
 
 
 async def get_by_id(id):
+    data = _cache.get(int(id))
+    if data is not None:
+        return dict(data)
     query = """
     SELECT * FROM "main"."accounts" WHERE rowid = ?
     """
     values = (id,)
-    async with aiosqlite.connect(database=database) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(query, values) as cur:
-            res = await cur.fetchone()
-            if res is None:
-                data = None
-            else:
-                data = {
+    db = await connect()
+    async with db.execute(query, values) as cur:
+        res = await cur.fetchone()
+        if res is None:
+            return None
+        data = to_account(res)
+        data.update(_pending.get(int(id), {}))
+        _cache[data["id"]] = data
+        return dict(data)
+
+
+async def get_all():
+    query = """
+    SELECT * FROM "main"."accounts"
+    """
+    out = []
+    await flush()
+    db = await connect()
+    async with db.execute(query) as cur:
+        result = await cur.fetchall()
+        for res in result:
+            out.append(
+                {
                     "id": res["id"],
                     "first_name": res["first_name"],
                     "balance": res["balance"],
-                    "token": res["token"],
-                    "useragent": res["useragent"],
                 }
-            return data
+            )
+        return out
 
 
-async def get_all():
+async def iter_accounts(size=1000):
     query = """
-    SELECT * FROM "main"."accounts"
+    SELECT "id", "first_name", "balance" FROM "main"."accounts" ORDER BY "id"
     """
-    out = []
-    async with aiosqlite.connect(database=database) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(query) as cur:
-            result = await cur.fetchall()
-            for res in result:
-                out.append(
-                    {
-                        "id": res["id"],
-                        "first_name": res["first_name"],
-                        "balance": res["balance"],
-                    }
-                )
-            return out
+    await flush()
+    db = await connect()
+    async with db.execute(query) as cur:
+        while True:
+            result = await cur.fetchmany(size)
+            if not result:
+                return
+            yield [
+                {
+                    "id": res["id"],
+                    "first_name": res["first_name"],
+                    "balance": res["balance"],
+                }
+                for res in result
+            ]
+
+
+async def get_totals():
+    query = """
+    SELECT "accounts", "balance" FROM "main"."totals" WHERE "id" = 1
+    """
+    await flush()
+    db = await connect()
+    async with db.execute(query) as cur:
+        res = await cur.fetchone()
+        if res is None:
+            return 0, 0
+        return res["accounts"], res["balance"]
+
+
+async def get_daily(days=7):
+    query = """
+    SELECT "day", "delta", "updates" FROM "main"."balance_daily"
+    ORDER BY "day" DESC LIMIT ?
+    """
+    await flush()
+    db = await connect()
+    async with db.execute(query, (days,)) as cur:
+        result = await cur.fetchall()
+        return [
+            {"day": res["day"], "delta": res["delta"], "updates": res["updates"]}
+            for res in result
+        ]
+
+
+async def get_summary(days=7):
+    try:
+        accounts, balance = await get_totals()
+        daily = await get_daily(days)
+    except sqlite3.OperationalError:
+        return None
+    today = datetime.now(tz=timezone.utc).strftime("%Y-%m-%d")
+    return {
+        "accounts": accounts,
+        "balance": balance,
+        "today": sum(i["delta"] for i in daily if i["day"] == today),
+        "average": sum(i["delta"] for i in daily) / len(daily) if daily else 0,
+        "daily": daily,
+    }
 
 
 async def insert(id, first_name):
     query = """
     INSERT INTO "main"."accounts" ("id", "first_name") VALUES (?, ?)
     """
+    query1 = """
+    UPDATE "main"."totals" SET "accounts" = "accounts" + 1 WHERE "id" = 1
+    """
     values = (
         id,
         first_name,
     )
-    async with aiosqlite.connect(database=database) as db:
+    db = await connect()
+    async with _write_lock:
         await db.execute(query, values)
+        await db.execute(query1)
         await db.commit()
+    data = {
+        "id": int(id),
+        "first_name": first_name,
+        "balance": None,
+        "token": None,
+        "token_exp": None,
+        "useragent": None,
+    }
+    _cache[data["id"]] = data
+    return dict(data)
 
 
 async def update_balance(id, balance):
+    if balance is None:
+        return
+    data = _cache.get(int(id))
+    old = data["balance"] if data is not None else None
+    if old == balance:
+        return
+    delta = balance - old if old is not None else None
+    now = int(datetime.now().timestamp())
+    _pending_history.append((int(id), balance, delta, balance - (old or 0), now))
+    await queue_update(id, balance=balance)
+
+
+async def update_token(id, token, exp=None):
+    await queue_update(id, token=token, token_exp=exp)
+
+
+async def update_useragent(id, useragent):
+    await queue_update(id, useragent=useragent)
+
+
+async def queue_update(id, **fields):
+    if int(id) in _cache:
+        _cache[int(id)].update(fields)
+    _pending.setdefault(int(id), {}).update(fields)
+    if len(_pending) >= flush_size:
+        await flush()
+
+
+async def flush():
+    global _pending, _pending_cooldowns, _pending_tasks, _pending_history
+    if (
+        not _pending
+        and not _pending_cooldowns
+        and not _pending_tasks
+        and not _pending_history
+    ):
+        return
+    query1 = """
+    UPDATE "main"."accounts" SET
+        "balance" = COALESCE(?, "balance"),
+        "token" = COALESCE(?, "token"),
+        "token_exp" = COALESCE(?, "token_exp"),
+        "useragent" = COALESCE(?, "useragent")
+    WHERE rowid = ?
+    """
+    query2 = """
+    INSERT OR REPLACE INTO "main"."cooldowns" ("id", "game", "blocked_until")
+    VALUES (?, ?, ?)
+    """
+    query3 = """
+    INSERT OR REPLACE INTO "main"."tasks" ("id", "task_id", "is_daily", "completed_at")
+    VALUES (?, ?, ?, ?)
+    """
+    query4 = """
+    INSERT INTO "main"."balance_history" ("id", "balance", "delta", "created_at")
+    VALUES (?, ?, ?, ?)
+    """
+    query5 = """
+    INSERT INTO "main"."balance_daily" ("day", "delta", "updates") VALUES (?, ?, ?)
+    ON CONFLICT ("day") DO UPDATE SET
+        "delta" = "delta" + "excluded"."delta",
+        "updates" = "updates" + "excluded"."updates"
+    """
+    query6 = """
+    UPDATE "main"."totals" SET "balance" = "balance" + ? WHERE "id" = 1
+    """
+    db = await connect()
+    pending, _pending = _pending, {}
+    pending_cooldowns, _pending_cooldowns = _pending_cooldowns, {}
+    pending_tasks, _pending_tasks = _pending_tasks, {}
+    pending_history, _pending_history = _pending_history, []
+    values1 = [
+        (
+            fields.get("balance"),
+            fields.get("token"),
+            fields.get("token_exp"),
+            fields.get("useragent"),
+            id,
+        )
+        for id, fields in pending.items()
+    ]
+    values2 = [
+        (id, game, blocked_until)
+        for (id, game), blocked_until in pending_cooldowns.items()
+    ]
+    values3 = [
+        (id, task_id, is_daily, completed_at)
+        for (id, task_id), (is_daily, completed_at) in pending_tasks.items()
+    ]
+    values4 = [
+        (id, balance, delta, created_at)
+        for id, balance, delta, change, created_at in pending_history
+    ]
+    daily = {}
+    for id, balance, delta, change, created_at in pending_history:
+        if delta is None:
+            continue
+        day = datetime.fromtimestamp(created_at, tz=timezone.utc).strftime("%Y-%m-%d")
+        total, updates = daily.get(day, (0, 0))
+        daily[day] = (total + delta, updates + 1)
+    values5 = [(day, total, updates) for day, (total, updates) in daily.items()]
+    change = sum(i[3] for i in pending_history)
+    try:
+        async with _write_lock:
+            try:
+                await db.executemany(query1, values1)
+                await db.executemany(query2, values2)
+                await db.executemany(query3, values3)
+                await db.executemany(query4, values4)
+                await db.executemany(query5, values5)
+                if change:
+                    await db.execute(query6, (change,))
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+    except sqlite3.OperationalError:
+        requeue(pending, pending_cooldowns, pending_tasks, pending_history)
+        raise
+    except sqlite3.DatabaseError as e:
+        statements = (
+            (query1, values1),
+            (query2, values2),
+            (query3, values3),
+            (query4, values4),
+        )
+        try:
+            async with _write_lock:
+                bad1, bad2, bad3, bad4 = await find_invalid(db, statements)
+        except BaseException:
+            requeue(pending, pending_cooldowns, pending_tasks, pending_history)
+            raise
+        dropped = len(bad1) + len(bad2) + len(bad3) + len(bad4)
+        if dropped <= 0:
+            requeue(pending, pending_cooldowns, pending_tasks, pending_history)
+            raise
+        requeue(
+            {k: v for i, (k, v) in enumerate(pending.items()) if i not in bad1},
+            {
+                k: v
+                for i, (k, v) in enumerate(pending_cooldowns.items())
+                if i not in bad2
+            },
+            {k: v for i, (k, v) in enumerate(pending_tasks.items()) if i not in bad3},
+            [v for i, v in enumerate(pending_history) if i not in bad4],
+        )
+        console.emit(
+            "error",
+            "database",
+            f"{red}dropped {white}{dropped}{red} invalid rows : {white}{e!r}",
+            dropped=dropped,
+        )
+        await flush()
+    except BaseException:
+        requeue(pending, pending_cooldowns, pending_tasks, pending_history)
+        raise
+
+
+async def find_invalid(db, statements):
+    invalid = []
+    try:
+        for query, values in statements:
+            bad = set()
+            for i, value in enumerate(values):
+                try:
+                    await db.execute(query, value)
+                except sqlite3.OperationalError:
+                    raise
+                except sqlite3.DatabaseError:
+                    bad.add(i)
+            invalid.append(bad)
+    finally:
+        await db.rollback()
+    return invalid
+
+
+def requeue(pending, pending_cooldowns, pending_tasks, pending_history):
+    for id, fields in pending.items():
+        _pending[id] = {**fields, **_pending.get(id, {})}
+    for key, blocked_until in pending_cooldowns.items():
+        _pending_cooldowns.setdefault(key, blocked_until)
+    for key, task in pending_tasks.items():
+        _pending_tasks.setdefault(key, task)
+    _pending_history[:0] = pending_history
+
+
+async def get_cooldowns(id):
+    return dict(_cooldowns.get(int(id), {}))
+
+
+async def update_cooldown(id, game, blocked_until):
+    _cooldowns.setdefault(int(id), {})[game] = blocked_until
+    _pending_cooldowns[(int(id), game)] = blocked_until
+    if len(_pending_cooldowns) >= flush_size:
+        await flush()
+
+
+async def load_cooldowns():
     query = """
-    UPDATE "main"."accounts" SET "balance" = ? WHERE rowid = ?
+    SELECT * FROM "main"."cooldowns"
     """
-    values = (
-        balance,
-        id,
-    )
-    async with aiosqlite.connect(database=database) as db:
-        await db.execute(query, values)
-        await db.commit()
+    db = await connect()
+    async with db.execute(query) as cur:
+        result = await cur.fetchall()
+    _cooldowns.clear()
+    for res in result:
+        _cooldowns.setdefault(res["id"], {})[res["game"]] = res["blocked_until"]
+
+
+async def flush_loop():
+    while True:
+        await asyncio.sleep(flush_interval)
+        try:
+            await flush()
+        except sqlite3.OperationalError:
+            continue
+        except Exception as e:
+            console.emit("error", "database", f"{red}failed to flush : {white}{e!r}")
 
 
-async def update_token(id, token):
+async def get_completed_tasks(id, is_daily):
+    tday = datetime.now(tz=timezone.utc).date()
+    out = set()
+    for task_id, (daily, completed_at) in _tasks.get(int(id), {}).items():
+        if bool(daily) != is_daily:
+            continue
+        if daily and datetime.fromtimestamp(completed_at, tz=timezone.utc).date() != tday:
+            continue
+        out.add(task_id)
+    return out
+
+
+async def complete_task(id, task_id, is_daily):
+    task = (int(is_daily), int(datetime.now().timestamp()))
+    _tasks.setdefault(int(id), {})[task_id] = task
+    _pending_tasks[(int(id), task_id)] = task
+    if len(_pending_tasks) >= flush_size:
+        await flush()
+
+
+async def load_tasks():
     query = """
-    UPDATE "main"."accounts" SET "token" = ? WHERE rowid = ?
+    SELECT * FROM "main"."tasks"
     """
-    values = (
-        token,
-        id,
-    )
-    async with aiosqlite.connect(database=database) as db:
-        await db.execute(query, values)
-        await db.commit()
+    db = await connect()
+    async with db.execute(query) as cur:
+        result = await cur.fetchall()
+    _tasks.clear()
+    for res in result:
+        _tasks.setdefault(res["id"], {})[res["task_id"]] = (
+            res["is_daily"],
+            res["completed_at"],
+        )
 
 
-async def update_useragent(id, useragent):
+async def add_column(table, column, definition):
+    query = f'PRAGMA table_info("{table}")'
+    db = await connect()
+    async with db.execute(query) as cur:
+        columns = [res["name"] for res in await cur.fetchall()]
+    if column not in columns:
+        await write(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}')
+
+
+async def column_type(table, column):
+    query = f'PRAGMA table_info("{table}")'
+    db = await connect()
+    async with db.execute(query) as cur:
+        for res in await cur.fetchall():
+            if res["name"] == column:
+                return res["type"].upper()
+
+
+async def migrate_accounts():
+    if await column_type("accounts", "balance") != "TEXT":
+        return
+    await add_column("accounts", "token_exp", "INTEGER NULL")
     query = """
-    UPDATE "main"."accounts" SET "useragent" = ? WHERE rowid = ?
+    BEGIN;
+    DROP TABLE IF EXISTS "accounts_new";
+    CREATE TABLE "accounts_new" (
+        "id" INTEGER NOT NULL,
+        "first_name" TEXT NULL,
+        "balance" NUMERIC NULL,
+        "token" TEXT NULL,
+        "useragent" TEXT NULL,
+        "token_exp" INTEGER NULL,
+        PRIMARY KEY ("id")
+    );
+    INSERT INTO "accounts_new"
+        ("id", "first_name", "balance", "token", "useragent", "token_exp")
+    SELECT
+        "id",
+        "first_name",
+        CASE WHEN TRIM("balance") = '' THEN NULL ELSE CAST("balance" AS NUMERIC) END,
+        "token",
+        "useragent",
+        "token_exp"
+    FROM "accounts";
+    DROP TABLE "accounts";
+    ALTER TABLE "accounts_new" RENAME TO "accounts";
+    COMMIT;
     """
-    values = (
-        useragent,
-        id,
-    )
-    async with aiosqlite.connect(database=database) as db:
-        await db.execute(query, values)
-        await db.commit()
+    db = await connect()
+    async with _write_lock:
+        try:
+            await db.executescript(query)
+        except Exception:
+            await db.rollback()
+            raise
 
 
-async def init():
+async def get_expiring(before):
+    return [
+        data["id"]
+        for data in _cache.values()
+        if data["token"] and (data["token_exp"] or 0) < before
+    ]
+
+
+async def migrate():
     query0 = "SELECT * FROM accounts IF "
     query1 = """
     CREATE TABLE IF NOT EXISTS "accounts" (
         "id" INTEGER NOT NULL,
         "first_name" TEXT NULL,
-        "balance" TEXT NULL,
+        "balance" NUMERIC NULL,
         "token" TEXT NULL,
         "useragent" TEXT NULL,
+        "token_exp" INTEGER NULL,
         PRIMARY KEY ("id")
     ); 
     """
-    query2 = "PRAGMA foreign_keys = true;"
-    async with aiosqlite.connect(database=database) as db:
-        await db.execute(query1)
-        await db.execute(query2)
-        await db.commit()
+    query2 = """
+    CREATE TABLE IF NOT EXISTS "cooldowns" (
+        "id" INTEGER NOT NULL,
+        "game" TEXT NOT NULL,
+        "blocked_until" INTEGER NOT NULL,
+        PRIMARY KEY ("id", "game")
+    );
+    """
+    query3 = """
+    CREATE TABLE IF NOT EXISTS "tasks" (
+        "id" INTEGER NOT NULL,
+        "task_id" INTEGER NOT NULL,
+        "is_daily" INTEGER NOT NULL,
+        "completed_at" INTEGER NOT NULL,
+        PRIMARY KEY ("id", "task_id")
+    );
+    """
+    query4 = """
+    CREATE TABLE IF NOT EXISTS "balance_history" (
+        "id" INTEGER NOT NULL,
+        "balance" NUMERIC NOT NULL,
+        "delta" NUMERIC NULL,
+        "created_at" INTEGER NOT NULL
+    );
+    """
+    query5 = """
+    CREATE INDEX IF NOT EXISTS "balance_history_id"
+    ON "balance_history" ("id", "created_at");
+    """
+    query6 = """
+    CREATE INDEX IF NOT EXISTS "balance_history_created_at"
+    ON "balance_history" ("created_at");
+    """
+    query7 = """
+    CREATE TABLE IF NOT EXISTS "balance_daily" (
+        "day" TEXT NOT NULL,
+        "delta" NUMERIC NOT NULL DEFAULT 0,
+        "updates" INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY ("day")
+    );
+    """
+    query8 = """
+    CREATE TABLE IF NOT EXISTS "totals" (
+        "id" INTEGER NOT NULL CHECK ("id" = 1),
+        "accounts" INTEGER NOT NULL DEFAULT 0,
+        "balance" NUMERIC NOT NULL DEFAULT 0,
+        PRIMARY KEY ("id")
+    );
+    """
+    query9 = """
+    INSERT OR IGNORE INTO "totals" ("id", "accounts", "balance")
+    SELECT 1, COUNT(*), COALESCE(SUM("balance"), 0) FROM "accounts"
+    """
+    await connect()
+    await write(query1)
+    await migrate_accounts()
+    await write(query2)
+    await write(query3)
+    await add_column("accounts", "token_exp", "INTEGER NULL")
+    await write(query4)
+    await write(query5)
+    await write(query6)
+    await write(query7)
+    await write(query8)
+    await write(query9)
+
+
+async def init():
+    global _flusher
+    await migrate()
+    await load_cache()
+    await load_cooldowns()
+    await load_tasks()
+    if _flusher is None:
+        _flusher = asyncio.create_task(flush_loop())
 
 
 class Config: